@@ -0,0 +1,141 @@
+import argparse
+import statistics
+import time
+
+from sqlalchemy import create_engine, func, select
+
+import search
+from schema import cookies, metadata
+
+FLAVORS = ["chocolate", "peanut", "oatmeal", "sugar", "ginger", "lemon", "almond"]
+STYLES = ["chip", "butter", "raisin", "snap", "crinkle", "shortbread", "macaroon"]
+
+POSTGRES_SEED = """
+INSERT INTO cookies (cookie_name, cookie_sku, quantity, unit_cost)
+SELECT
+    (ARRAY{flavors})[1 + i % {flavor_count}] || ' '
+        || (ARRAY{styles})[1 + (i / {flavor_count}) % {style_count}] || ' ' || i,
+    'CK' || i,
+    i % 100,
+    0.50
+FROM generate_series(1, {count}) AS i
+"""
+
+SQLITE_SEED = """
+WITH RECURSIVE series(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM series
+                             WHERE i < {count})
+INSERT INTO cookies (cookie_name, cookie_sku, quantity, unit_cost)
+SELECT
+    json_extract('{flavors_json}', '$[' || (i % {flavor_count}) || ']') || ' '
+        || json_extract('{styles_json}',
+                        '$[' || ((i / {flavor_count}) % {style_count}) || ']')
+        || ' ' || i,
+    'CK' || i,
+    i % 100,
+    0.50
+FROM series
+"""
+
+
+def seed(engine, count):
+    """Fill the cookies table with `count` generated cookies, in the database."""
+    options = {
+        "count": count,
+        "flavor_count": len(FLAVORS),
+        "style_count": len(STYLES),
+    }
+    if engine.dialect.name == "postgresql":
+        statement = POSTGRES_SEED.format(flavors=FLAVORS, styles=STYLES, **options)
+    else:
+        statement = SQLITE_SEED.format(
+            flavors_json=str(FLAVORS).replace("'", '"'),
+            styles_json=str(STYLES).replace("'", '"'),
+            **options
+        )
+    engine.execute(statement)
+    engine.execute("ANALYZE")
+
+
+def timed(engine, statement, repeat):
+    """Run a statement `repeat` times.
+
+    Returns:
+        tuple: The timings in milliseconds and the number of rows returned.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = engine.execute(statement).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings, len(rows)
+
+
+def queries(dialect, terms):
+    """Return `(name, statement)` for the queries compared for `terms`."""
+    # The LIKE query from core.py, unbounded, with the columns of the search.
+    like = select([cookies.c.cookie_id, cookies.c.cookie_name]).where(
+        cookies.c.cookie_name.like("%{}%".format(terms))
+    )
+    # A page of it, shortest names first as a crude rank. Like the search rank,
+    # the order is not served by an index, so every match is sorted before the
+    # first 20 are returned.
+    like_page = like.order_by(
+        func.length(cookies.c.cookie_name), cookies.c.cookie_id
+    ).limit(20)
+    ranked = search.search_query(dialect, terms)
+    # Drops one letter. Only Postgres tolerates typos, SQLite reports 0 rows.
+    typo = search.search_query(dialect, terms[:-2] + terms[-1:])
+    return [
+        ("like", like),
+        ("like page", like_page),
+        ("search", ranked),
+        ("search typo", typo),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare cookie search latency against a LIKE query."
+    )
+    parser.add_argument("url")
+    parser.add_argument("--cookies", type=int, default=5000000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--terms", default="chocolate")
+    parser.add_argument("--rare-terms", default="pistachio")
+    parser.add_argument("--no-seed", action="store_true")
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    metadata.create_all(engine)
+    if not args.no_seed:
+        seed(engine, args.cookies)
+    search.install(engine)
+    total = engine.execute(select([func.count()]).select_from(cookies)).scalar()
+
+    print("{total} cookies, {repeat} runs".format(total=total, repeat=args.repeat))
+    print(
+        "{:>12} {:>16} {:>8} {:>10} {:>10} {:>10}".format(
+            "terms", "query", "rows", "median", "p95", "max"
+        )
+    )
+    # A common term, where LIKE and the search both return many matches, and a
+    # term no cookie contains, where LIKE has to scan the whole table.
+    for terms in [args.terms, args.rare_terms]:
+        for name, statement in queries(engine.dialect, terms):
+            timings, row_count = timed(engine, statement, args.repeat)
+            timings.sort()
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            print(
+                "{:>12} {:>16} {:>8} {:>8.2f}ms {:>8.2f}ms {:>8.2f}ms".format(
+                    terms,
+                    name,
+                    row_count,
+                    statistics.median(timings),
+                    p95,
+                    timings[-1],
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
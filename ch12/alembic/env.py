@@ -65,14 +65,42 @@ def run_migrations_online():
         poolclass=pool.NullPool,
     )
 
+    # Post-upgrade check of the query plans, enabled with
+    # `alembic -x plan_baseline=<path> upgrade head`. `-x plan_queries=<name>`
+    # picks the query set from queries.py, the new_cookies queries by default.
+    # Only runs when upgrade steps were applied, not after a downgrade or stamp.
+    x_arguments = context.get_x_argument(  # pylint: disable=no-member
+        as_dictionary=True
+    )
+    plan_baseline = x_arguments.get("plan_baseline")
+    plan_queries = x_arguments.get("plan_queries", "ch12")
+    upgrades = []
+
+    def record_upgrade(ctx, step, heads, run_args):
+        if step.is_upgrade and not step.is_stamp:
+            upgrades.append(step.up_revision_id)
+
     with connectable.connect() as connection:
         context.configure(  # pylint: disable=no-member
-            connection=connection, target_metadata=target_metadata
+            connection=connection,
+            target_metadata=target_metadata,
+            on_version_apply=record_upgrade,
         )
 
         with context.begin_transaction():  # pylint: disable=no-member
             context.run_migrations()  # pylint: disable=no-member
 
+        if plan_baseline and upgrades:
+            # plan_guard and queries live at the root of the repository.
+            sys.path.append(
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+            )
+            from plan_guard import check  # pylint: disable=import-error
+            from queries import QUERY_SETS  # pylint: disable=import-error
+
+            queries = QUERY_SETS[plan_queries](connection.dialect)
+            check(connection, plan_baseline, queries=queries)
+
 
 if context.is_offline_mode():  # pylint: disable=no-member
     run_migrations_offline()
@@ -0,0 +1,93 @@
+"""Add cookie search vector
+
+Revision ID: 5f2a9c3e7b14
+Revises: 134d1ba7cd27
+Create Date: 2026-10-19 10:12:31.482907
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "5f2a9c3e7b14"
+down_revision = "134d1ba7cd27"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name == "sqlite":  # pylint: disable=no-member
+        op.execute(  # pylint: disable=no-member
+            """
+            CREATE VIRTUAL TABLE new_cookies_fts USING fts5(
+                cookie_name, content='new_cookies', content_rowid='cookie_id',
+                tokenize='porter unicode61'
+            )
+            """
+        )
+        op.execute(  # pylint: disable=no-member
+            """
+            CREATE TRIGGER new_cookies_fts_insert AFTER INSERT ON new_cookies
+            BEGIN
+                INSERT INTO new_cookies_fts (rowid, cookie_name)
+                VALUES (NEW.cookie_id, NEW.cookie_name);
+            END
+            """
+        )
+        op.execute(  # pylint: disable=no-member
+            """
+            CREATE TRIGGER new_cookies_fts_delete AFTER DELETE ON new_cookies
+            BEGIN
+                INSERT INTO new_cookies_fts (new_cookies_fts, rowid, cookie_name)
+                VALUES ('delete', OLD.cookie_id, OLD.cookie_name);
+            END
+            """
+        )
+        op.execute(  # pylint: disable=no-member
+            """
+            CREATE TRIGGER new_cookies_fts_update
+            AFTER UPDATE OF cookie_name ON new_cookies
+            BEGIN
+                INSERT INTO new_cookies_fts (new_cookies_fts, rowid, cookie_name)
+                VALUES ('delete', OLD.cookie_id, OLD.cookie_name);
+                INSERT INTO new_cookies_fts (rowid, cookie_name)
+                VALUES (NEW.cookie_id, NEW.cookie_name);
+            END
+            """
+        )
+        op.execute(  # pylint: disable=no-member
+            "INSERT INTO new_cookies_fts (new_cookies_fts) VALUES ('rebuild')"
+        )
+        return
+    op.add_column(  # pylint: disable=no-member
+        "new_cookies",
+        sa.Column(
+            "search_vector",
+            postgresql.TSVECTOR(),
+            sa.Computed(
+                "to_tsvector('english', coalesce(cookie_name, ''))", persisted=True
+            ),
+        ),
+    )
+    op.create_index(  # pylint: disable=no-member
+        "ix_new_cookies_search_vector",
+        "new_cookies",
+        ["search_vector"],
+        postgresql_using="gin",
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == "sqlite":  # pylint: disable=no-member
+        for trigger in ("insert", "delete", "update"):
+            op.execute(  # pylint: disable=no-member
+                "DROP TRIGGER new_cookies_fts_{}".format(trigger)
+            )
+        op.execute("DROP TABLE new_cookies_fts")  # pylint: disable=no-member
+        return
+    op.drop_index(  # pylint: disable=no-member
+        "ix_new_cookies_search_vector", table_name="new_cookies"
+    )
+    op.drop_column("new_cookies", "search_vector")  # pylint: disable=no-member
@@ -0,0 +1,38 @@
+"""Add cookie name trigram index
+
+Revision ID: 9d41e6b2c805
+Revises: 5f2a9c3e7b14
+Create Date: 2026-10-19 10:14:02.117350
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "9d41e6b2c805"
+down_revision = "5f2a9c3e7b14"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # pg_trgm is Postgres only, SQLite search goes through FTS5 instead.
+    if op.get_bind().dialect.name != "postgresql":  # pylint: disable=no-member
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")  # pylint: disable=no-member
+    op.create_index(  # pylint: disable=no-member
+        "ix_new_cookies_cookie_name_trgm",
+        "new_cookies",
+        ["cookie_name"],
+        postgresql_using="gin",
+        postgresql_ops={"cookie_name": "gin_trgm_ops"},
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != "postgresql":  # pylint: disable=no-member
+        return
+    op.drop_index(  # pylint: disable=no-member
+        "ix_new_cookies_cookie_name_trgm", table_name="new_cookies"
+    )
@@ -0,0 +1,236 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.engine.url import make_url
+
+from schema import cookies, line_items, metadata, orders, users
+
+# Tables with a serial primary key, in foreign key order.
+SEQUENCES = [
+    (cookies, "cookie_id"),
+    (users, "user_id"),
+    (orders, "order_id"),
+    (line_items, "line_item_id"),
+]
+
+
+def reset_primary_key_sequence(connection, table, _id, reset_to=1):
+    connection.execute(
+        "ALTER SEQUENCE {table}_{_id}_seq RESTART WITH {start};".format(
+            table=table, _id=_id, start=reset_to
+        )
+    )
+
+
+def key_ranges(count, workers):
+    """Split the keys 1..count into at most `workers` contiguous ranges.
+
+    Returns:
+        list: `(start, stop)` pairs, `stop` exclusive.
+    """
+    size = -(-count // workers) if count else 0
+    return [
+        (start, min(start + size, count + 1))
+        for start in range(1, count + 1, size or 1)
+    ]
+
+
+def generate_cookie(cookie_id):
+    return {
+        "cookie_id": cookie_id,
+        "cookie_name": "cookie {}".format(cookie_id),
+        "cookie_recipe_url": "http://some.aweso.me/cookie/{}.html".format(cookie_id),
+        "cookie_sku": "CK{:06d}".format(cookie_id),
+        "quantity": 1000,
+        "unit_cost": Decimal("0.50"),
+    }
+
+
+def generate_user(user_id):
+    return {
+        "user_id": user_id,
+        "username": "user{:010d}".format(user_id),
+        "email_address": "user{}@cookie.com".format(user_id),
+        "phone": "{:03d}-{:03d}-{:04d}".format(
+            user_id % 1000, user_id // 1000 % 1000, user_id % 10000
+        ),
+        "password": "password",
+    }
+
+
+def generate_order(order_id, orders_per_user):
+    return {
+        "order_id": order_id,
+        "user_id": (order_id - 1) // orders_per_user + 1,
+        "shipped": order_id % 2 == 0,
+    }
+
+
+def generate_line_item(line_item_id, items_per_order, cookie_count):
+    quantity = line_item_id % 12 + 1
+    return {
+        "line_item_id": line_item_id,
+        "order_id": (line_item_id - 1) // items_per_order + 1,
+        "cookie_id": line_item_id % cookie_count + 1,
+        "quantity": quantity,
+        "extended_cost": Decimal("0.50") * quantity,
+    }
+
+
+def create_loader_engine(url, chunk_size=1000):
+    """Create an engine that sends each chunk of rows in few round trips.
+
+    psycopg2's executemany sends one statement per row. With
+    `executemany_mode="values"` SQLAlchemy folds a chunk into multi-row
+    `INSERT ... VALUES` statements instead. Other drivers are left as they
+    are.
+    """
+    if make_url(url).drivername in ("postgresql", "postgresql+psycopg2"):
+        return create_engine(
+            url, executemany_mode="values", executemany_values_page_size=chunk_size
+        )
+    return create_engine(url)
+
+
+def _rows(table, start, stop, options):
+    for key in range(start, stop):
+        if table is users:
+            yield generate_user(key)
+        elif table is orders:
+            yield generate_order(key, options["orders_per_user"])
+        else:
+            yield generate_line_item(
+                key, options["items_per_order"], options["cookie_count"]
+            )
+
+
+def load_range(url, table_name, start, stop, options):
+    """Insert the rows with keys start..stop-1 of one table.
+
+    Runs in a worker process, with its own engine and connection, and
+    streams the rows in chunks of `options["chunk_size"]`.
+
+    Returns:
+        int: Number of rows inserted.
+    """
+    table = metadata.tables[table_name]
+    engine = create_loader_engine(url, options["chunk_size"])
+    chunk = []
+    with engine.connect() as connection:
+        for row in _rows(table, start, stop, options):
+            chunk.append(row)
+            if len(chunk) == options["chunk_size"]:
+                connection.execute(table.insert(), chunk)
+                chunk = []
+        if chunk:
+            connection.execute(table.insert(), chunk)
+    engine.dispose()
+    return stop - start
+
+
+# pylint: disable=no-value-for-parameter
+def load(
+    url,
+    user_count,
+    orders_per_user=2,
+    items_per_order=3,
+    cookie_count=100,
+    workers=None,
+    chunk_size=1000,
+):
+    """Generate and load cookies, users, orders and line items.
+
+    Users, orders and line items are split into key ranges and loaded by a
+    process pool, one table at a time so that foreign keys always point at
+    rows that are already committed. Sequences are reset afterwards.
+
+    Rows get the explicit ids 1..N, so the tables must be empty: on a seeded
+    database, e.g. after running core.py, the inserts fail with an
+    IntegrityError.
+
+    Args:
+        url (str): Database URL, passed to each worker.
+        user_count (int): Number of users to generate.
+        orders_per_user (int): Orders generated for each user.
+        items_per_order (int): Line items generated for each order.
+        cookie_count (int): Number of cookies to generate.
+        workers (int): Worker processes. Defaults to the number of CPUs.
+        chunk_size (int): Rows per insert statement.
+
+    Returns:
+        dict: Table name to number of rows inserted.
+
+    Raises:
+        ValueError: If `cookie_count` is below 1, line items need a cookie.
+    """
+    if cookie_count < 1:
+        raise ValueError(
+            "cookie_count must be at least 1, got {count}".format(count=cookie_count)
+        )
+    workers = workers or os.cpu_count()
+    options = {
+        "orders_per_user": orders_per_user,
+        "items_per_order": items_per_order,
+        "cookie_count": cookie_count,
+        "chunk_size": chunk_size,
+    }
+    engine = create_loader_engine(url, chunk_size)
+    metadata.create_all(engine)
+    engine.execute(
+        cookies.insert(), [generate_cookie(i) for i in range(1, cookie_count + 1)]
+    )
+
+    counts = {"cookies": cookie_count}
+    order_count = user_count * orders_per_user
+    stages = [
+        (users, user_count),
+        (orders, order_count),
+        (line_items, order_count * items_per_order),
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for table, count in stages:
+            futures = [
+                executor.submit(load_range, url, table.name, start, stop, options)
+                for start, stop in key_ranges(count, workers)
+            ]
+            counts[table.name] = sum(future.result() for future in futures)
+
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as connection:
+            for table, _id in SEQUENCES:
+                last_id = connection.execute(select([func.max(table.c[_id])])).scalar()
+                reset_primary_key_sequence(
+                    connection, table.name, _id, (last_id or 0) + 1
+                )
+    engine.dispose()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=load.__doc__.splitlines()[0])
+    parser.add_argument("url")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--orders-per-user", type=int, default=2)
+    parser.add_argument("--items-per-order", type=int, default=3)
+    parser.add_argument("--cookies", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+    counts = load(
+        args.url,
+        args.users,
+        orders_per_user=args.orders_per_user,
+        items_per_order=args.items_per_order,
+        cookie_count=args.cookies,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+    )
+    for name, count in counts.items():
+        print("{name:>12}: {count}".format(name=name, count=count))
+
+
+if __name__ == "__main__":
+    main()
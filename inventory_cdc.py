@@ -0,0 +1,342 @@
+import json
+import queue
+import selectors
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    func,
+    Integer,
+    MetaData,
+    select,
+    String,
+    Table,
+)
+
+CHANNEL = "inventory_changes"
+
+InventoryChange = namedtuple(
+    "InventoryChange", ["cookie_id", "old_quantity", "new_quantity", "transaction_id"]
+)
+
+# Outbox used on SQLite, which has no LISTEN/NOTIFY. Triggers on `cookies`
+# append a row per change and the stream reads the outbox, never `cookies`.
+# AUTOINCREMENT keeps change ids growing after acknowledged rows are deleted,
+# a plain INTEGER PRIMARY KEY would hand out ids the reader has already passed.
+outbox_metadata = MetaData()
+
+inventory_changes = Table(
+    CHANNEL,
+    outbox_metadata,
+    Column("change_id", Integer(), primary_key=True),
+    Column("cookie_id", Integer(), nullable=False),
+    Column("old_quantity", Integer()),
+    Column("new_quantity", Integer()),
+    Column("transaction_id", Integer()),
+    Column("changed_on", DateTime(), server_default=func.current_timestamp()),
+    sqlite_autoincrement=True,
+)
+
+# Progress of each subscriber through the outbox. An outbox row is deleted
+# once every subscriber has acknowledged it.
+inventory_subscribers = Table(
+    "inventory_subscribers",
+    outbox_metadata,
+    Column("subscriber", String(50), primary_key=True),
+    Column("last_change_id", Integer(), nullable=False, default=0),
+)
+
+POSTGRES_TRIGGER = """
+CREATE OR REPLACE FUNCTION notify_inventory_change() RETURNS trigger AS $$
+DECLARE
+    payload json;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        payload := json_build_object(
+            'cookie_id', NEW.cookie_id,
+            'old_quantity', NULL,
+            'new_quantity', NEW.quantity,
+            'transaction_id', txid_current());
+    ELSIF TG_OP = 'DELETE' THEN
+        payload := json_build_object(
+            'cookie_id', OLD.cookie_id,
+            'old_quantity', OLD.quantity,
+            'new_quantity', NULL,
+            'transaction_id', txid_current());
+    ELSIF OLD.quantity IS DISTINCT FROM NEW.quantity THEN
+        payload := json_build_object(
+            'cookie_id', NEW.cookie_id,
+            'old_quantity', OLD.quantity,
+            'new_quantity', NEW.quantity,
+            'transaction_id', txid_current());
+    ELSE
+        RETURN NULL;
+    END IF;
+    PERFORM pg_notify('inventory_changes', payload::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS cookies_inventory_change ON cookies;
+CREATE TRIGGER cookies_inventory_change
+    AFTER INSERT OR UPDATE OF quantity OR DELETE ON cookies
+    FOR EACH ROW EXECUTE FUNCTION notify_inventory_change();
+"""
+
+# SQLite has no transaction id, so `transaction_id` is left NULL there.
+SQLITE_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS cookies_inventory_insert
+    AFTER INSERT ON cookies
+    BEGIN
+        INSERT INTO inventory_changes (cookie_id, old_quantity, new_quantity)
+        VALUES (NEW.cookie_id, NULL, NEW.quantity);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS cookies_inventory_update
+    AFTER UPDATE OF quantity ON cookies
+    WHEN OLD.quantity IS NOT NEW.quantity
+    BEGIN
+        INSERT INTO inventory_changes (cookie_id, old_quantity, new_quantity)
+        VALUES (NEW.cookie_id, OLD.quantity, NEW.quantity);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS cookies_inventory_delete
+    AFTER DELETE ON cookies
+    BEGIN
+        INSERT INTO inventory_changes (cookie_id, old_quantity, new_quantity)
+        VALUES (OLD.cookie_id, OLD.quantity, NULL);
+    END
+    """,
+]
+
+
+def install(engine):
+    """Install the triggers that publish changes to `cookies.quantity`.
+
+    Args:
+        engine (Engine): Engine with the `cookies` table already created.
+    """
+    if engine.dialect.name == "postgresql":
+        engine.execute(POSTGRES_TRIGGER)
+    elif engine.dialect.name == "sqlite":
+        outbox_metadata.create_all(engine)
+        for trigger in SQLITE_TRIGGERS:
+            engine.execute(trigger)
+    else:
+        raise NotImplementedError(
+            "No inventory change capture for {name}".format(name=engine.dialect.name)
+        )
+
+
+# pylint: disable=no-value-for-parameter
+def _delete_acknowledged(connection):
+    """Delete the outbox rows every subscriber has acknowledged."""
+    connection.execute(
+        inventory_changes.delete().where(
+            inventory_changes.c.change_id
+            <= select([func.min(inventory_subscribers.c.last_change_id)]).as_scalar()
+        )
+    )
+
+
+def unsubscribe(engine, subscriber):
+    """Forget a SQLite subscriber, so the outbox no longer keeps rows for it."""
+    with engine.begin() as connection:
+        connection.execute(
+            inventory_subscribers.delete().where(
+                inventory_subscribers.c.subscriber == subscriber
+            )
+        )
+        _delete_acknowledged(connection)
+
+
+class InventoryChangeStream:
+    """Deliver `InventoryChange` events to Python code in batches.
+
+    A background thread listens on the `inventory_changes` channel (Postgres)
+    or reads the outbox table (SQLite) and puts events on a bounded queue.
+    When the consumer falls behind and the queue is full, the thread blocks
+    instead of reading more: notifications stay buffered in Postgres and
+    outbox rows stay in the table until they are consumed.
+
+    Delivery guarantees differ per backend:
+
+    * SQLite: at least once. Every subscriber keeps its own position in the
+      outbox, which moves on `acknowledge`. Changes delivered but not
+      acknowledged are delivered again when a stream for the same subscriber
+      starts. A new subscriber starts with the oldest change still in the
+      outbox, and a subscriber that never comes back keeps the outbox from
+      shrinking until it is removed with `unsubscribe`.
+    * Postgres: at most once. NOTIFY only reaches sessions listening at the
+      time, so changes made while no stream runs are lost, as are changes
+      still queued when `stop` is called. Every stream receives every change
+      and `acknowledge` does nothing.
+
+    Args:
+        engine (Engine): Engine the triggers were installed on.
+        subscriber (str): Name the outbox position is kept under, SQLite only.
+        batch_size (int): Largest number of events in one batch.
+        max_pending (int): Events held in memory before the reader blocks.
+        max_wait (float): Seconds to wait for a batch to fill up before
+            handing over what has arrived so far.
+    """
+
+    def __init__(
+        self,
+        engine,
+        subscriber="default",
+        batch_size=100,
+        max_pending=1000,
+        max_wait=0.5,
+    ):
+        self.engine = engine
+        self.subscriber = subscriber
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._stopped = threading.Event()
+        self._thread = None
+        self._delivered_change_id = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def pending(self):
+        """Events read from the database but not yet handed to the consumer."""
+        return self._queue.qsize()
+
+    def start(self):
+        if self.engine.dialect.name == "postgresql":
+            target = self._listen
+        else:
+            self.engine.execute(
+                inventory_subscribers.insert()
+                .prefix_with("OR IGNORE")
+                .values(subscriber=self.subscriber, last_change_id=0)
+            )
+            target = self._read_outbox
+        self._stopped.clear()
+        self._thread = threading.Thread(target=target, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def batches(self):
+        """Yield lists of `InventoryChange` until the stream is stopped.
+
+        Asking for the next batch acknowledges the previous one. A consumer
+        that leaves the loop calls `acknowledge` for the last batch it
+        handled.
+        """
+        while not self._stopped.is_set() or not self._queue.empty():
+            batch = self._next_batch()
+            if batch:
+                self._delivered_change_id = batch[-1][0]
+                yield [change for _, change in batch]
+                self.acknowledge()
+
+    def acknowledge(self):
+        """Mark every change delivered so far as handled by this subscriber.
+
+        On SQLite this moves the subscriber's position and deletes the outbox
+        rows all subscribers have acknowledged. On Postgres it does nothing.
+        """
+        if self._delivered_change_id is None:
+            return
+        with self.engine.begin() as connection:
+            connection.execute(
+                inventory_subscribers.update()
+                .where(inventory_subscribers.c.subscriber == self.subscriber)
+                .values(last_change_id=self._delivered_change_id)
+            )
+            _delete_acknowledged(connection)
+        self._delivered_change_id = None
+
+    def _next_batch(self):
+        batch = []
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _put(self, item):
+        # Blocks while the queue is full, which is the backpressure.
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _listen(self):
+        connection = self.engine.raw_connection()
+        try:
+            dbapi_connection = connection.connection
+            dbapi_connection.autocommit = True
+            cursor = dbapi_connection.cursor()
+            cursor.execute("LISTEN {channel};".format(channel=CHANNEL))
+            selector = selectors.DefaultSelector()
+            selector.register(dbapi_connection, selectors.EVENT_READ)
+            while not self._stopped.is_set():
+                if not selector.select(timeout=self.max_wait):
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    notify = dbapi_connection.notifies.pop(0)
+                    self._put((None, InventoryChange(**json.loads(notify.payload))))
+            cursor.execute("UNLISTEN {channel};".format(channel=CHANNEL))
+            selector.close()
+            dbapi_connection.autocommit = False
+        finally:
+            connection.close()
+
+    def _read_outbox(self):
+        last_change_id = self.engine.execute(
+            select([inventory_subscribers.c.last_change_id]).where(
+                inventory_subscribers.c.subscriber == self.subscriber
+            )
+        ).scalar()
+        while not self._stopped.is_set():
+            s = (
+                select([inventory_changes])
+                .where(inventory_changes.c.change_id > last_change_id)
+                .order_by(inventory_changes.c.change_id)
+                .limit(self.batch_size)
+            )
+            rows = self.engine.execute(s).fetchall()
+            for row in rows:
+                self._put(
+                    (
+                        row.change_id,
+                        InventoryChange(
+                            row.cookie_id,
+                            row.old_quantity,
+                            row.new_quantity,
+                            row.transaction_id,
+                        ),
+                    )
+                )
+                last_change_id = row.change_id
+            if not rows:
+                self._stopped.wait(self.max_wait / 5)
@@ -0,0 +1,264 @@
+import argparse
+import hashlib
+import json
+import re
+import sys
+from collections import Counter, namedtuple
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.sql.util import find_tables
+
+from queries import CANONICAL_QUERIES, QUERY_SETS
+
+Regression = namedtuple("Regression", ["query", "message"])
+
+
+class PlanRegressionError(Exception):
+    def __init__(self, regressions):
+        self.regressions = regressions
+        super().__init__(
+            "Query plan regressions:\n"
+            + "\n".join(
+                "  {query}: {message}".format(query=query, message=message)
+                for query, message in regressions
+            )
+        )
+
+
+class MissingTablesError(Exception):
+    def __init__(self, tables):
+        self.tables = tables
+        super().__init__(
+            "The queries read tables missing from the database: {names}. Check "
+            "the query set matches the schema.".format(names=", ".join(tables))
+        )
+
+
+def compile_query(statement, dialect):
+    return str(
+        statement.compile(dialect=dialect, compile_kwargs={"literal_binds": True})
+    )
+
+
+def explain(connection, statement):
+    """Return the plan of a statement as a tree of Postgres style nodes.
+
+    On Postgres this is the root of `EXPLAIN (FORMAT JSON)`. On SQLite the
+    rows of `EXPLAIN QUERY PLAN` are turned into the same kind of tree, with
+    the SCAN, SEARCH and temp b-tree steps mapped to Seq Scan, Index Scan and
+    Sort nodes, and no costs.
+
+    Args:
+        connection (Connection): Connection to a seeded database.
+        statement (Select): Query to explain.
+    """
+    sql = compile_query(statement, connection.dialect)
+    if connection.dialect.name == "postgresql":
+        result = connection.execute("EXPLAIN (FORMAT JSON) " + sql).scalar()
+        if isinstance(result, str):
+            result = json.loads(result)
+        return result[0]["Plan"]
+    if connection.dialect.name == "sqlite":
+        # pysqlite caches prepared statements by their text and a cached
+        # EXPLAIN keeps its old plan after DDL, so key it on the schema version.
+        schema_version = connection.execute("PRAGMA schema_version").scalar()
+        rows = connection.execute(
+            "EXPLAIN QUERY PLAN /* schema {} */ {}".format(schema_version, sql)
+        ).fetchall()
+        nodes = {0: {"Node Type": "Query", "Plans": []}}
+        for node_id, parent_id, _, detail in rows:
+            nodes[node_id] = dict(sqlite_node(detail), Plans=[])
+            nodes.get(parent_id, nodes[0])["Plans"].append(nodes[node_id])
+        return nodes[0]
+    raise NotImplementedError(
+        "No query plans for {name}".format(name=connection.dialect.name)
+    )
+
+
+def sqlite_node(detail):
+    """Map one `EXPLAIN QUERY PLAN` detail string to a plan node."""
+    match = re.match(
+        r"(SCAN|SEARCH) (\w+)(?: USING (?:COVERING )?INDEX (\w+))?", detail
+    )
+    if match:
+        access, relation, index = match.groups()
+        if access == "SCAN" and index is None:
+            return {"Node Type": "Seq Scan", "Relation Name": relation}
+        if index is None:
+            index = "PRIMARY KEY" if "PRIMARY KEY" in detail else None
+        node = {"Node Type": "Index Scan", "Relation Name": relation}
+        if index:
+            node["Index Name"] = index
+        return node
+    if detail.startswith("USE TEMP B-TREE"):
+        return {"Node Type": "Sort"}
+    return {"Node Type": re.sub(r"\d+", "N", detail)}
+
+
+def normalize(plan):
+    """Reduce a plan to its shape: node types, the relations and indexes they
+    read and the join type, without costs, row estimates or aliases.
+    """
+    shape = {"node": plan["Node Type"]}
+    for key, name in [
+        ("Relation Name", "relation"),
+        ("Index Name", "index"),
+        ("Join Type", "join"),
+    ]:
+        if key in plan:
+            shape[name] = plan[key]
+    children = [normalize(child) for child in plan.get("Plans", [])]
+    if children:
+        shape["children"] = children
+    return shape
+
+
+def fingerprint(shape):
+    return hashlib.sha1(json.dumps(shape, sort_keys=True).encode()).hexdigest()
+
+
+def capture(connection, queries=None):
+    """Explain every canonical query and record its plan.
+
+    Args:
+        connection (Connection): Connection to a seeded database.
+        queries (dict): Name to query. Defaults to the queries from core.py.
+
+    Returns:
+        dict: Name to the plan `fingerprint`, `shape` and `total_cost`.
+
+    Raises:
+        MissingTablesError: If the queries read tables the database lacks.
+    """
+    queries = CANONICAL_QUERIES if queries is None else queries
+    existing = set(inspect(connection).get_table_names())
+    missing = {
+        table.name
+        for statement in queries.values()
+        for table in find_tables(statement, include_crud=True)
+    } - existing
+    if missing:
+        raise MissingTablesError(sorted(missing))
+    plans = {}
+    for name, statement in queries.items():
+        plan = explain(connection, statement)
+        shape = normalize(plan)
+        plans[name] = {
+            "fingerprint": fingerprint(shape),
+            "shape": shape,
+            "total_cost": plan.get("Total Cost"),
+        }
+    return plans
+
+
+def _nodes(shape):
+    label = shape["node"]
+    if "relation" in shape:
+        label += " on " + shape["relation"]
+    if "index" in shape:
+        label += " using " + shape["index"]
+    yield label
+    for child in shape.get("children", []):
+        yield from _nodes(child)
+
+
+def compare(baseline, current, cost_threshold=1.2):
+    """Find plans that changed shape or got more expensive.
+
+    Args:
+        baseline (dict): Plans from an earlier `capture`.
+        current (dict): Plans from the latest `capture`.
+        cost_threshold (float): Largest allowed ratio of current to baseline
+            total cost.
+
+    Returns:
+        list: `Regression` for each change, including queries missing from
+            the baseline, empty when nothing regressed.
+    """
+    regressions = []
+    for name, before in baseline.items():
+        after = current.get(name)
+        if after is None:
+            regressions.append(Regression(name, "query is no longer captured"))
+            continue
+        if after["fingerprint"] != before["fingerprint"]:
+            old_nodes = Counter(_nodes(before["shape"]))
+            new_nodes = Counter(_nodes(after["shape"]))
+            removed = sorted((old_nodes - new_nodes).elements())
+            added = sorted((new_nodes - old_nodes).elements())
+            if removed or added:
+                message = "plan changed: removed [{}], added [{}]".format(
+                    ", ".join(removed), ", ".join(added)
+                )
+            else:
+                message = "plan changed: nodes were reordered"
+            regressions.append(Regression(name, message))
+        old_cost, new_cost = before["total_cost"], after["total_cost"]
+        if old_cost and new_cost and new_cost > old_cost * cost_threshold:
+            regressions.append(
+                Regression(
+                    name,
+                    "cost went from {:.2f} to {:.2f}".format(old_cost, new_cost),
+                )
+            )
+    for name in sorted(set(current) - set(baseline)):
+        regressions.append(
+            Regression(name, "query is not in the baseline, re-capture it")
+        )
+    return regressions
+
+
+def save_baseline(path, plans):
+    with open(path, "w") as f:
+        json.dump(plans, f, indent=2, sort_keys=True)
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def check(connection, baseline_path, cost_threshold=1.2, queries=None):
+    """Compare the plans of `connection` against a saved baseline.
+
+    Args:
+        queries (dict): Name to query. Defaults to the queries from core.py.
+
+    Raises:
+        MissingTablesError: If the queries read tables the database lacks.
+        PlanRegressionError: If any query regressed.
+    """
+    regressions = compare(
+        load_baseline(baseline_path), capture(connection, queries), cost_threshold
+    )
+    if regressions:
+        raise PlanRegressionError(regressions)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Capture or check the query plans of the canonical queries."
+    )
+    parser.add_argument("command", choices=["capture", "check"])
+    parser.add_argument("url")
+    parser.add_argument("baseline")
+    parser.add_argument("--cost-threshold", type=float, default=1.2)
+    parser.add_argument("--queries", choices=sorted(QUERY_SETS), default="core")
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    queries = QUERY_SETS[args.queries](engine.dialect)
+    with engine.connect() as connection:
+        if args.command == "capture":
+            save_baseline(args.baseline, capture(connection, queries))
+            return
+        try:
+            check(connection, args.baseline, args.cost_threshold, queries)
+        except (MissingTablesError, PlanRegressionError) as e:
+            print(e)
+            sys.exit(1)
+    print("No query plan regressions.")
+
+
+if __name__ == "__main__":
+    main()
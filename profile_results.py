@@ -0,0 +1,401 @@
+import argparse
+import inspect
+import io
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from pprint import pprint
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.dialects.postgresql import psycopg2
+from sqlalchemy.dialects.sqlite import pysqlite  # pylint: disable=unused-import
+from sqlalchemy.engine import default, result
+from sqlalchemy.sql import type_api
+
+from fixture_loader import generate_cookie
+from schema import cookies, metadata
+
+DRIVER_FETCH = "driver fetch"
+ROW_CONSTRUCTION = "row construction"
+TYPE_PROCESSING = "type processing"
+SQLALCHEMY = "sqlalchemy other"
+USER_CODE = "user code"
+CATEGORIES = [DRIVER_FETCH, ROW_CONSTRUCTION, TYPE_PROCESSING, SQLALCHEMY, USER_CODE]
+
+
+def _line_range(function):
+    lines, first = inspect.getsourcelines(function)
+    return first, first + len(lines) - 1
+
+
+# SQLAlchemy functions that call into the DBAPI cursor. Time and memory spent
+# in the driver, which is C code, shows up on these Python frames.
+DRIVER_FUNCTIONS = [
+    result.ResultProxy._fetchone_impl,
+    result.ResultProxy._fetchmany_impl,
+    result.ResultProxy._fetchall_impl,
+    result.BufferedRowResultProxy._fetchone_impl,
+    result.BufferedRowResultProxy._fetchmany_impl,
+    result.BufferedRowResultProxy._fetchall_impl,
+    result.BufferedRowResultProxy._BufferedRowResultProxy__buffer_rows,
+    default.DefaultDialect.do_execute,
+    default.DefaultDialect.do_executemany,
+    default.DefaultDialect.do_execute_no_params,
+    psycopg2.PGDialect_psycopg2.do_executemany,
+]
+DRIVER_LINES = {}
+for _function in DRIVER_FUNCTIONS:
+    DRIVER_LINES.setdefault(inspect.getsourcefile(_function), []).append(
+        _line_range(_function)
+    )
+
+SQLALCHEMY_DIR = os.path.dirname(os.path.dirname(result.__file__))
+# The pure Python processors, used without the C extensions.
+TYPE_PATHS = [os.path.join(SQLALCHEMY_DIR, "processors.py")]
+DRIVER_MODULES = ["psycopg2", "sqlite3"]
+
+
+class ProcessorTimer:
+    """Wrap every result processor SQLAlchemy hands to a result set in a
+    timed Python function.
+
+    With the C extensions, conversions such as `Numeric` to `Decimal` run in
+    C when a row value is accessed and leave no Python frame behind. The
+    wrapper gives them one, which the sampler and tracemalloc attribute to
+    type processing, and measures their total duration directly. The extra
+    Python call per value adds some overhead of its own.
+    """
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        self._original = None
+
+    def wrap(self, processor):
+        def timed_processor(value):
+            start = time.perf_counter()
+            try:
+                return processor(value)
+            finally:
+                self.seconds += time.perf_counter() - start
+                self.calls += 1
+
+        return timed_processor
+
+    def __enter__(self):
+        original = self._original = type_api.TypeEngine._cached_result_processor
+
+        def _cached_result_processor(type_, dialect, coltype):
+            processor = original(type_, dialect, coltype)
+            return self.wrap(processor) if processor is not None else None
+
+        type_api.TypeEngine._cached_result_processor = _cached_result_processor
+        return self
+
+    def __exit__(self, *exc_info):
+        type_api.TypeEngine._cached_result_processor = self._original
+
+
+def _subclasses(cls):
+    yield cls
+    for subclass in cls.__subclasses__():
+        yield from _subclasses(subclass)
+
+
+# `result_processor` of every type, in sqltypes and in the dialects imported
+# above, with the closures it returns. The rest of those modules, like the
+# dialects' execution code, is not type processing.
+TYPE_LINES = {__file__: [_line_range(ProcessorTimer.wrap)]}
+for _type in set(_subclasses(type_api.TypeEngine)):
+    _function = _type.__dict__.get("result_processor")
+    if inspect.isfunction(_function):
+        TYPE_LINES.setdefault(inspect.getsourcefile(_function), []).append(
+            _line_range(_function)
+        )
+
+
+def classify(filename, lineno):
+    """Attribute one frame to a category.
+
+    Args:
+        filename (str): Source file of the frame.
+        lineno (int): Line being executed in the frame.
+    """
+    for start, end in DRIVER_LINES.get(filename, []):
+        if start <= lineno <= end:
+            return DRIVER_FETCH
+    for start, end in TYPE_LINES.get(filename, []):
+        if start <= lineno <= end:
+            return TYPE_PROCESSING
+    parts = filename.split(os.sep)
+    if any(module in parts for module in DRIVER_MODULES):
+        return DRIVER_FETCH
+    if any(filename.startswith(path) for path in TYPE_PATHS):
+        return TYPE_PROCESSING
+    if os.path.basename(filename) in ("decimal.py", "_pydecimal.py"):
+        return TYPE_PROCESSING
+    if filename == result.__file__:
+        return ROW_CONSTRUCTION
+    if filename.startswith(SQLALCHEMY_DIR + os.sep):
+        return SQLALCHEMY
+    return USER_CODE
+
+
+def classify_stack(stack):
+    """Attribute a stack, innermost frame last, to the category of the
+    innermost frame that is not user code.
+
+    User code only wins when nothing below it is database work, so that
+    `rp.fetchall()` called from user code counts as driver fetch.
+    """
+    category = USER_CODE
+    for filename, lineno, _ in stack:
+        frame_category = classify(filename, lineno)
+        if frame_category != USER_CODE:
+            category = frame_category
+    return category
+
+
+class Sampler(threading.Thread):
+    """Sample the stack of one thread about every `interval` seconds.
+
+    The sampler needs the GIL to run, so samples arrive less often than
+    asked when the sampled thread holds it. Each sample is therefore
+    weighted by the time measured since the previous one.
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self.seconds = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        last = time.perf_counter()
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, frame.f_lineno, code.co_name))
+                frame = frame.f_back
+            if stack:
+                stack = tuple(reversed(stack))
+                self.samples[stack] += 1
+                self.seconds[stack] += now - last
+            last = now
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class Profile:
+    """Time samples and live allocations recorded while running a query path.
+
+    Attributes:
+        samples (Counter): Stack, outermost frame first, to number of samples.
+        seconds (Counter): Stack to the measured time its samples stand for.
+        allocations (list): `(stack, size, count)` for each allocation site
+            still alive when the path returned.
+        processors (ProcessorTimer): Calls to and time spent in result
+            processors, measured directly.
+    """
+
+    def __init__(self, samples, seconds, allocations, processors):
+        self.samples = samples
+        self.seconds = seconds
+        self.allocations = allocations
+        self.processors = processors
+
+    def summary(self):
+        """Return `(category, seconds, share of time, bytes, share of bytes,
+        blocks)` for every category.
+        """
+        seconds = Counter()
+        sizes = Counter()
+        blocks = Counter()
+        for stack, elapsed in self.seconds.items():
+            seconds[classify_stack(stack)] += elapsed
+        for stack, size, count in self.allocations:
+            sizes[classify_stack(stack)] += size
+            blocks[classify_stack(stack)] += count
+        total_seconds = sum(seconds.values()) or 1
+        total_size = sum(sizes.values()) or 1
+        return [
+            (
+                category,
+                seconds[category],
+                seconds[category] / total_seconds,
+                sizes[category],
+                sizes[category] / total_size,
+                blocks[category],
+            )
+            for category in CATEGORIES
+        ]
+
+    def format_summary(self):
+        lines = [
+            "{:>18} {:>10} {:>7} {:>12} {:>7} {:>9}".format(
+                "category", "time", "%", "memory", "%", "blocks"
+            )
+        ]
+        for category, secs, time_share, size, size_share, count in self.summary():
+            lines.append(
+                "{:>18} {:>9.3f}s {:>6.1%} {:>10.1f}KB {:>6.1%} {:>9}".format(
+                    category, secs, time_share, size / 1024, size_share, count
+                )
+            )
+        lines.append(
+            "result processors: {calls} calls, {seconds:.3f}s measured".format(
+                calls=self.processors.calls, seconds=self.processors.seconds
+            )
+        )
+        return "\n".join(lines)
+
+    def write_folded(self, f, kind="time"):
+        """Write stacks in the folded format read by flamegraph.pl and
+        speedscope, with the category as the root frame.
+
+        Args:
+            f (file): Open text file.
+            kind (str): "time" weighs stacks by sampled microseconds,
+                "memory" by bytes.
+        """
+        if kind == "time":
+            weighted = [
+                (stack, round(elapsed * 1e6)) for stack, elapsed in self.seconds.items()
+            ]
+        else:
+            weighted = [(stack, size) for stack, size, _ in self.allocations]
+        for stack, weight in weighted:
+            frames = [classify_stack(stack)] + [
+                "{name} ({file}:{line})".format(
+                    name=name, file=os.path.basename(filename), line=lineno
+                )
+                for filename, lineno, name in stack
+            ]
+            f.write("{} {}\n".format(";".join(frames), weight))
+
+
+def profile(path, *args, interval=0.001, nframes=50):
+    """Run `path(*args)` under tracemalloc and a sampling profiler.
+
+    Args:
+        path (callable): Query path to profile.
+        interval (float): Seconds between stack samples.
+        nframes (int): Frames kept per allocation traceback.
+
+    Returns:
+        Profile: Samples and allocations of the run.
+    """
+    sampler = Sampler(threading.get_ident(), interval)
+    # Let the sampler take the GIL about as often as it asks for it.
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(min(switch_interval, interval))
+    tracemalloc.start(nframes)
+    sampler.start()
+    try:
+        with ProcessorTimer() as processors:
+            retained = path(*args)
+            snapshot = tracemalloc.take_snapshot()
+            del retained
+    finally:
+        sampler.stop()
+        tracemalloc.stop()
+        sys.setswitchinterval(switch_interval)
+    # Drop the sampler thread's own allocations, which all pass threading.py.
+    snapshot = snapshot.filter_traces(
+        [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, threading.__file__, all_frames=True),
+        ]
+    )
+    allocations = []
+    for stat in snapshot.statistics("traceback"):
+        # tracemalloc frames have no function names.
+        stack = tuple((frame.filename, frame.lineno, "?") for frame in stat.traceback)
+        allocations.append((stack, stat.size, stat.count))
+    return Profile(sampler.samples, sampler.seconds, allocations, processors)
+
+
+# Query paths from core.py. Each returns its results so their memory is still
+# alive when the snapshot is taken.
+def fetchall_and_pprint(engine):
+    rp = engine.execute(select([cookies]))
+    results = rp.fetchall()
+    pprint(results, stream=io.StringIO())
+    return results
+
+
+def first_row_lookups(engine):
+    results = engine.execute(select([cookies])).fetchall()
+    names = [row[cookies.c.cookie_name] for row in results]
+    return results, names
+
+
+def iterate_rows(engine):
+    return [record.cookie_name for record in engine.execute(cookies.select())]
+
+
+def unit_costs(engine):
+    results = engine.execute(select([cookies])).fetchall()
+    return [row.unit_cost for row in results]
+
+
+QUERY_PATHS = {
+    "fetchall": fetchall_and_pprint,
+    "column_lookup": first_row_lookups,
+    "iterate": iterate_rows,
+    "unit_cost": unit_costs,
+}
+
+
+# pylint: disable=no-value-for-parameter
+def seed(engine, count, chunk_size=10000):
+    """Top the cookies table up to `count` rows."""
+    metadata.create_all(engine)
+    existing = engine.execute(select([func.count()]).select_from(cookies)).scalar()
+    for start in range(existing + 1, count + 1, chunk_size):
+        stop = min(start + chunk_size, count + 1)
+        engine.execute(
+            cookies.insert(), [generate_cookie(i) for i in range(start, stop)]
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Profile time and allocations of a result processing path."
+    )
+    parser.add_argument("url")
+    parser.add_argument("--path", choices=sorted(QUERY_PATHS), default="fetchall")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--interval", type=float, default=0.001)
+    parser.add_argument("--time-folded", help="Write sampled stacks to this file.")
+    parser.add_argument("--memory-folded", help="Write allocation stacks here.")
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    seed(engine, args.rows)
+    start = time.perf_counter()
+    run = profile(QUERY_PATHS[args.path], engine, interval=args.interval)
+    print(
+        "{path}: {rows} rows in {elapsed:.3f}s".format(
+            path=args.path, rows=args.rows, elapsed=time.perf_counter() - start
+        )
+    )
+    print(run.format_summary())
+    for filename, kind in [(args.time_folded, "time"), (args.memory_folded, "memory")]:
+        if filename:
+            with open(filename, "w") as f:
+                run.write_folded(f, kind)
+
+
+if __name__ == "__main__":
+    main()
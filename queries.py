@@ -0,0 +1,150 @@
+from sqlalchemy import (
+    and_,
+    cast,
+    delete,
+    desc,
+    func,
+    literal_column,
+    MetaData,
+    Numeric,
+    or_,
+    select,
+    text,
+    update,
+)
+
+from schema import cookies, line_items, orders, users
+from search import search_query
+
+# The cookies table as renamed by the ch12 Alembic chain.
+new_cookies = cookies.tometadata(MetaData(), name="new_cookies")
+
+
+def orders_by_customer_query(customer_name, shipped=None, details=False):
+    """Build the query behind `get_orders_by_customers` from core.py.
+
+    Args:
+        customer_name (str): Username to fetch orders for.
+        shipped (bool): Only return orders with this shipped flag, if set.
+        details (bool): Include the cookies and line items of each order.
+    """
+    columns = [
+        orders.c.order_id,
+        users.c.username,
+        users.c.phone,
+    ]
+    joins = users.join(orders)
+    if details:
+        columns.extend(
+            [
+                cookies.c.cookie_name,
+                line_items.c.quantity,
+                line_items.c.extended_cost,
+            ]
+        )
+        joins = joins.join(line_items).join(cookies)
+    customer_orders = (
+        select(columns).select_from(joins).where(users.c.username == customer_name)
+    )
+    if shipped is not None:
+        customer_orders = customer_orders.where(orders.c.shipped == shipped)
+    return customer_orders
+
+
+# The queries run by core.py, by name. Statements core.py repeats with other
+# literals, like the later lookups of "dark chocolate chip", have one entry.
+# pylint: disable=no-value-for-parameter
+CANONICAL_QUERIES = {
+    "all_cookies": select([cookies]),
+    "cookies_by_quantity": select([cookies.c.cookie_name, cookies.c.quantity])
+    .order_by(cookies.c.quantity)
+    .limit(2),
+    "cookies_by_quantity_desc": select(
+        [cookies.c.cookie_name, cookies.c.quantity]
+    ).order_by(desc(cookies.c.quantity)),
+    "inventory_sum": select([func.sum(cookies.c.quantity)]),
+    "inventory_count": select(
+        [func.count(cookies.c.cookie_name).label("inventory_count")]
+    ),
+    "cookie_by_name": select([cookies]).where(
+        cookies.c.cookie_name == "chocolate chip"
+    ),
+    "cookies_like": select([cookies]).where(cookies.c.cookie_name.like("%chocolate%")),
+    "cookie_skus": select([cookies.c.cookie_name, "SKU-" + cookies.c.cookie_sku]),
+    "inventory_cost": select(
+        [
+            cookies.c.cookie_name,
+            cast((cookies.c.quantity * cookies.c.unit_cost), Numeric(12, 2)).label(
+                "inv_cost"
+            ),
+        ]
+    ),
+    "cookies_and": select([cookies]).where(
+        and_(cookies.c.quantity > 23, cookies.c.unit_cost < 0.40)
+    ),
+    "cookies_or": select([cookies]).where(
+        or_(
+            cookies.c.quantity.between(10, 50),
+            cookies.c.cookie_name.contains("chip"),
+        )
+    ),
+    "update_cookie_by_name": update(cookies)
+    .where(cookies.c.cookie_name == "chocolate chip")
+    .values(quantity=(cookies.c.quantity + 120)),
+    "delete_cookie_by_name": delete(cookies).where(
+        cookies.c.cookie_name == "dark chocolate chip"
+    ),
+    "cookiemon_orders": select(
+        [
+            orders.c.order_id,
+            users.c.username,
+            users.c.phone,
+            cookies.c.cookie_name,
+            line_items.c.quantity,
+            line_items.c.extended_cost,
+        ]
+    )
+    .select_from(orders.join(users).join(line_items).join(cookies))
+    .where(users.c.username == "cookiemon"),
+    "order_counts": select([users.c.username, func.count(orders.c.order_id)])
+    .select_from(users.outerjoin(orders))
+    .group_by(users.c.username),
+    "orders_by_customer": orders_by_customer_query("cakeeater"),
+    "orders_by_customer_details": orders_by_customer_query("cakeeater", details=True),
+    "orders_by_customer_shipped": orders_by_customer_query("cakeeater", shipped=True),
+    "orders_by_customer_unshipped_details": orders_by_customer_query(
+        "cakeeater", shipped=False, details=True
+    ),
+    # core.py runs this one as raw SQL.
+    "all_orders": select([literal_column("*")]).select_from(orders),
+    "user_by_username": select([users]).where(text("username='cookiemon'")),
+}
+
+
+def core_queries(dialect):  # pylint: disable=unused-argument
+    return CANONICAL_QUERIES
+
+
+def new_cookies_queries(dialect):
+    """Queries over the ch12 `new_cookies` table, including the search its
+    Alembic revisions index.
+
+    Args:
+        dialect (Dialect): Dialect the queries will run on.
+    """
+    return {
+        "all_cookies": select([new_cookies]),
+        "cookie_by_name": select([new_cookies]).where(
+            new_cookies.c.cookie_name == "chocolate chip"
+        ),
+        "cookies_like": select([new_cookies]).where(
+            new_cookies.c.cookie_name.like("%chocolate%")
+        ),
+        "search": search_query(dialect, "chocolate chip", table=new_cookies),
+        "search_typo": search_query(dialect, "choclate", table=new_cookies),
+    }
+
+
+# Query sets the plan guard can check, by name. Each builds its queries for a
+# dialect.
+QUERY_SETS = {"core": core_queries, "ch12": new_cookies_queries}
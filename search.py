@@ -0,0 +1,161 @@
+import re
+
+from sqlalchemy import (
+    column,
+    desc,
+    func,
+    literal,
+    literal_column,
+    or_,
+    select,
+    table as table_,
+)
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+from schema import cookies
+
+# Generated column holding the full text of each cookie, Postgres only.
+search_vector = column("search_vector", TSVECTOR)
+
+POSTGRES_SEARCH_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """
+    ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', coalesce(cookie_name, ''))) STORED
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS ix_{table}_search_vector
+    ON {table} USING gin (search_vector)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS ix_{table}_cookie_name_trgm
+    ON {table} USING gin (cookie_name gin_trgm_ops)
+    """,
+]
+
+# External content FTS5 table kept in sync with the cookies table by triggers.
+SQLITE_SEARCH_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(
+        cookie_name, content='{table}', content_rowid='cookie_id',
+        tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table}
+    BEGIN
+        INSERT INTO {table}_fts (rowid, cookie_name)
+        VALUES (NEW.cookie_id, NEW.cookie_name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table}
+    BEGIN
+        INSERT INTO {table}_fts ({table}_fts, rowid, cookie_name)
+        VALUES ('delete', OLD.cookie_id, OLD.cookie_name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {table}_fts_update
+    AFTER UPDATE OF cookie_name ON {table}
+    BEGIN
+        INSERT INTO {table}_fts ({table}_fts, rowid, cookie_name)
+        VALUES ('delete', OLD.cookie_id, OLD.cookie_name);
+        INSERT INTO {table}_fts (rowid, cookie_name)
+        VALUES (NEW.cookie_id, NEW.cookie_name);
+    END
+    """,
+    "INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')",
+]
+
+
+def install(engine, table=cookies):
+    """Add the search column and indexes to a cookies table that is not
+    managed by Alembic, e.g. the one created by core.py. ch12 gets the same
+    objects from its Alembic revisions.
+
+    Args:
+        engine (Engine): Engine with the cookies table already created.
+        table (Table): Cookies table to index.
+    """
+    if engine.dialect.name == "postgresql":
+        statements = POSTGRES_SEARCH_DDL
+    elif engine.dialect.name == "sqlite":
+        statements = SQLITE_SEARCH_DDL
+    else:
+        raise NotImplementedError(
+            "No cookie search for {name}".format(name=engine.dialect.name)
+        )
+    for statement in statements:
+        engine.execute(statement.format(table=table.name))
+
+
+def fts5_query(terms):
+    """Turn free text into an FTS5 query matching every word as a prefix."""
+    words = re.findall(r"\w+", terms)
+    return " ".join('"{word}"*'.format(word=word) for word in words)
+
+
+def search_query(dialect, terms, page=1, per_page=20, table=cookies):
+    """Build a ranked, paginated search over cookie names.
+
+    On Postgres, cookies match when the full text query matches or `terms`
+    is similar to some run of words in the name according to pg_trgm's
+    `word_similarity`, so a typo in one word still finds results. Rank is
+    the sum of `ts_rank` and the word similarity. On SQLite the
+    FTS5 table is searched with every word as a prefix and ranked by bm25.
+
+    Args:
+        dialect (Dialect): Dialect the query will run on.
+        terms (str): Text the user searched for.
+        page (int): Page to return, starting at 1.
+        per_page (int): Results per page.
+        table (Table): Cookies table to search.
+    """
+    if dialect.name == "postgresql":
+        query = func.websearch_to_tsquery("english", terms)
+        similarity = func.word_similarity(terms, table.c.cookie_name)
+        rank = (func.ts_rank(search_vector, query) + similarity).label("rank")
+        # pg_trgm's word similarity operator, `terms <% cookie_name`, served by
+        # the gin_trgm_ops index. `%` is escaped for pyformat drivers.
+        similar = "<%%" if dialect.paramstyle in ("format", "pyformat") else "<%"
+        s = (
+            select([table.c.cookie_id, table.c.cookie_name, rank])
+            .select_from(table)
+            .where(
+                or_(
+                    search_vector.op("@@")(query),
+                    literal(terms).op(similar)(table.c.cookie_name),
+                )
+            )
+        )
+    elif dialect.name == "sqlite":
+        fts_name = "{table}_fts".format(table=table.name)
+        fts = table_(fts_name, column("rowid"))
+        rank = (-func.bm25(literal_column(fts_name))).label("rank")
+        s = (
+            select([table.c.cookie_id, table.c.cookie_name, rank])
+            .select_from(table.join(fts, fts.c.rowid == table.c.cookie_id))
+            .where(literal_column(fts_name).op("MATCH")(fts5_query(terms)))
+        )
+    else:
+        raise NotImplementedError(
+            "No cookie search for {name}".format(name=dialect.name)
+        )
+    return (
+        s.order_by(desc("rank"), table.c.cookie_id)
+        .limit(per_page)
+        .offset((page - 1) * per_page)
+    )
+
+
+def search_cookies(engine, terms, page=1, per_page=20, table=cookies):
+    """Search cookie names.
+
+    Returns:
+        list: Rows of `cookie_id`, `cookie_name` and `rank`, best first.
+    """
+    if not re.search(r"\w", terms):
+        return []
+    s = search_query(engine.dialect, terms, page, per_page, table)
+    return engine.execute(s).fetchall()
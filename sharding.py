@@ -0,0 +1,460 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    ForeignKey,
+    func,
+    Integer,
+    MetaData,
+    select,
+    String,
+    Table,
+)
+
+from queries import orders_by_customer_query
+from schema import cookies, line_items, metadata, orders, users
+
+# Directory schema. It lives on a single engine and records which shard owns
+# each user, and which user owns each order. Allocating the ids here keeps
+# user_id and order_id unique across every shard.
+directory_metadata = MetaData()
+
+user_shards = Table(
+    "user_shards",
+    directory_metadata,
+    Column("user_id", Integer(), primary_key=True),
+    Column("username", String(15), nullable=False, unique=True),
+    Column("shard_id", Integer(), nullable=False),
+    # Set while `move_user` moves the user, new orders are refused meanwhile.
+    Column("moving", Boolean(), nullable=False, default=False),
+)
+
+order_shards = Table(
+    "order_shards",
+    directory_metadata,
+    Column("order_id", Integer(), primary_key=True),
+    Column("user_id", ForeignKey("user_shards.user_id"), nullable=False),
+)
+
+
+class ShardMoveError(Exception):
+    pass
+
+
+class ReplicationError(Exception):
+    """Raised when some shards failed to commit a write to replicated data.
+
+    Attributes:
+        failures (dict): Shard ID to the exception raised by its commit.
+    """
+
+    def __init__(self, failures):
+        super().__init__(
+            "Write failed to commit on shards {ids}".format(ids=sorted(failures))
+        )
+        self.failures = failures
+
+
+class ShardedDatabase:
+    """Spread `users`, `orders` and `line_items` over several engines by
+    `user_id`, keeping a full copy of `cookies` on every shard.
+
+    Args:
+        engines (list): One engine per shard.
+        directory (Engine): Engine holding the directory tables. Defaults to
+            the first shard.
+    """
+
+    def __init__(self, engines, directory=None):
+        self.engines = list(engines)
+        self.directory = directory if directory is not None else self.engines[0]
+
+    def create_all(self):
+        for engine in self.engines:
+            metadata.create_all(engine)
+        directory_metadata.create_all(self.directory)
+
+    def shard_for(self, user_id):
+        s = select([user_shards.c.shard_id]).where(user_shards.c.user_id == user_id)
+        shard_id = self.directory.execute(s).scalar()
+        if shard_id is None:
+            raise KeyError("Unknown user ID: {id}".format(id=user_id))
+        return shard_id
+
+    def engine_for(self, user_id):
+        return self.engines[self.shard_for(user_id)]
+
+    # pylint: disable=no-value-for-parameter
+    def insert_user(self, **values):
+        """Register a user in the directory and insert it on its shard.
+
+        New users are placed on shard `user_id % len(engines)`.
+
+        Returns:
+            int: The allocated user ID.
+        """
+        with self.directory.begin() as connection:
+            result = connection.execute(
+                user_shards.insert().values(username=values["username"], shard_id=0)
+            )
+            user_id = result.inserted_primary_key[0]
+            shard_id = user_id % len(self.engines)
+            connection.execute(
+                user_shards.update()
+                .where(user_shards.c.user_id == user_id)
+                .values(shard_id=shard_id)
+            )
+        try:
+            self.engines[shard_id].execute(
+                users.insert().values(user_id=user_id, **values)
+            )
+        except Exception:
+            self.directory.execute(
+                user_shards.delete().where(user_shards.c.user_id == user_id)
+            )
+            raise
+        return user_id
+
+    def _placement(self, connection, user_id, lock=False):
+        s = select([user_shards.c.shard_id, user_shards.c.moving]).where(
+            user_shards.c.user_id == user_id
+        )
+        if lock:
+            s = s.with_for_update()
+        placement = connection.execute(s).first()
+        if placement is None:
+            raise KeyError("Unknown user ID: {id}".format(id=user_id))
+        if placement.moving:
+            raise ShardMoveError(
+                "User ID {id} is being moved between shards".format(id=user_id)
+            )
+        return placement.shard_id
+
+    def insert_order(self, user_id, order_items, order_id=None, shipped=False):
+        """Insert an order and its line items on the shard owning the user.
+
+        The directory transaction stays open, with the user's directory row
+        locked, until the shard transaction has committed, so `move_user`
+        cannot start moving the user in between.
+
+        Args:
+            user_id (int): User placing the order.
+            order_items (list): Line item rows, without `order_id`.
+            order_id (int): Explicit order ID. Allocated from the directory
+                when not given.
+
+        Returns:
+            int: The order ID.
+
+        Raises:
+            ShardMoveError: If the user is being moved to another shard.
+        """
+        ins = order_shards.insert().values(user_id=user_id)
+        if order_id is not None:
+            ins = ins.values(order_id=order_id)
+        with self.directory.connect() as connection:
+            transaction = connection.begin()
+            try:
+                # Writing first takes the directory write lock on SQLite, which
+                # ignores FOR UPDATE.
+                order_id = connection.execute(ins).inserted_primary_key[0]
+                shard_id = self._placement(connection, user_id, lock=True)
+                shard = self.engines[shard_id]
+                if shard is self.directory:
+                    self._write_order(
+                        connection, order_id, user_id, order_items, shipped
+                    )
+                else:
+                    with shard.begin() as shard_connection:
+                        self._write_order(
+                            shard_connection, order_id, user_id, order_items, shipped
+                        )
+            except Exception:
+                transaction.rollback()
+                raise
+            try:
+                transaction.commit()
+            except Exception:
+                if shard is not self.directory:
+                    self._delete_orders(shard, [order_id])
+                raise
+        return order_id
+
+    @staticmethod
+    def _write_order(connection, order_id, user_id, order_items, shipped):
+        connection.execute(
+            orders.insert().values(order_id=order_id, user_id=user_id, shipped=shipped)
+        )
+        if order_items:
+            connection.execute(
+                line_items.insert(),
+                [dict(item, order_id=order_id) for item in order_items],
+            )
+
+    @staticmethod
+    def _delete_orders(connection, order_ids, user_id=None):
+        """Delete orders and their line items, and the user if given."""
+        if order_ids:
+            connection.execute(
+                line_items.delete().where(line_items.c.order_id.in_(order_ids))
+            )
+            connection.execute(orders.delete().where(orders.c.order_id.in_(order_ids)))
+        if user_id is not None:
+            connection.execute(users.delete().where(users.c.user_id == user_id))
+
+    def get_orders_by_customers(self, customer_name, shipped=None, details=False):
+        s = select([user_shards.c.shard_id]).where(
+            user_shards.c.username == customer_name
+        )
+        shard_id = self.directory.execute(s).scalar()
+        if shard_id is None:
+            return []
+        customer_orders = orders_by_customer_query(customer_name, shipped, details)
+        return self.engines[shard_id].execute(customer_orders).fetchall()
+
+    # Reference data.
+    def _write_all(self, write):
+        """Call `write(shard_id, connection)` for every shard, each in its own
+        transaction, and commit the transactions only once every write ran.
+
+        A failing write rolls every shard back. A failing commit cannot undo
+        the shards already committed, so their copies may differ afterwards,
+        see `diverged_replicas`.
+
+        Returns:
+            list: What `write` returned for each shard.
+
+        Raises:
+            ReplicationError: If some shards failed to commit.
+        """
+        connections = [engine.connect() for engine in self.engines]
+        try:
+            transactions = [connection.begin() for connection in connections]
+            try:
+                results = [
+                    write(shard_id, connection)
+                    for shard_id, connection in enumerate(connections)
+                ]
+            except Exception:
+                for transaction in transactions:
+                    transaction.rollback()
+                raise
+            failures = {}
+            for shard_id, transaction in enumerate(transactions):
+                try:
+                    transaction.commit()
+                except Exception as exc:  # pylint: disable=broad-except
+                    failures[shard_id] = exc
+        finally:
+            for connection in connections:
+                connection.close()
+        if failures:
+            raise ReplicationError(failures)
+        return results
+
+    def insert_cookies(self, inventory_list):
+        """Insert cookies on the first shard and copy them, with the same
+        cookie IDs, to every other shard.
+
+        Returns:
+            list: The cookie IDs, in the order of `inventory_list`.
+
+        Raises:
+            ReplicationError: If some shards failed to commit.
+        """
+        rows = []
+
+        def write(shard_id, connection):
+            if shard_id == 0:
+                for cookie in inventory_list:
+                    result = connection.execute(cookies.insert().values(**cookie))
+                    rows.append(dict(cookie, cookie_id=result.inserted_primary_key[0]))
+            else:
+                connection.execute(cookies.insert(), rows)
+
+        self._write_all(write)
+        return [row["cookie_id"] for row in rows]
+
+    def execute_on_all(self, statement, *multiparams, **params):
+        """Run a statement against every shard, e.g. an `update(cookies)`
+        that has to reach every copy of the reference table.
+
+        Returns:
+            list: One result per shard.
+
+        Raises:
+            ReplicationError: If some shards failed to commit.
+        """
+        return self._write_all(
+            lambda shard_id, connection: connection.execute(
+                statement, *multiparams, **params
+            )
+        )
+
+    def diverged_replicas(self, table=cookies):
+        """Compare every copy of a replicated table with the first shard's.
+
+        `order_counts` and the joins of `get_orders_by_customers` read
+        whichever copy is local, so the copies have to stay identical.
+
+        Returns:
+            list: IDs of the shards whose copy differs.
+        """
+        s = select([table]).order_by(*table.primary_key)
+        expected = self.engines[0].execute(s).fetchall()
+        return [
+            shard_id
+            for shard_id, engine in enumerate(self.engines[1:], start=1)
+            if engine.execute(s).fetchall() != expected
+        ]
+
+    # Scatter-gather.
+    def scatter(self, statement):
+        """Run a select on every shard in parallel and concatenate the rows."""
+
+        def fetch(engine):
+            return engine.execute(statement).fetchall()
+
+        with ThreadPoolExecutor(max_workers=len(self.engines)) as executor:
+            shard_rows = list(executor.map(fetch, self.engines))
+        return [row for rows in shard_rows for row in rows]
+
+    def order_counts(self):
+        """Count orders per username across all shards.
+
+        Returns:
+            dict: Username to number of orders.
+        """
+        columns = [users.c.username, func.count(orders.c.order_id)]
+        all_orders = (
+            select(columns)
+            .select_from(users.outerjoin(orders))
+            .group_by(users.c.username)
+        )
+        counts = {}
+        for username, count in self.scatter(all_orders):
+            counts[username] = counts.get(username, 0) + count
+        return counts
+
+    # Rebalancing.
+    def _copy_orders(self, source, target, user_id, copied_ids):
+        """Copy the user's orders not in `copied_ids`, with their line items,
+        from source to target. Adds the copied order IDs to `copied_ids`.
+
+        Returns:
+            int: Number of orders copied.
+        """
+        s = orders.select().where(orders.c.user_id == user_id)
+        if copied_ids:
+            s = s.where(orders.c.order_id.notin_(copied_ids))
+        user_orders = source.execute(s).fetchall()
+        if not user_orders:
+            return 0
+        order_ids = [order.order_id for order in user_orders]
+        user_line_items = source.execute(
+            line_items.select().where(line_items.c.order_id.in_(order_ids))
+        ).fetchall()
+        with target.begin() as connection:
+            connection.execute(orders.insert(), [dict(order) for order in user_orders])
+            if user_line_items:
+                # line_item_id is shard local, let the target assign new ones.
+                connection.execute(
+                    line_items.insert(),
+                    [
+                        {
+                            key: value
+                            for key, value in dict(item).items()
+                            if key != "line_item_id"
+                        }
+                        for item in user_line_items
+                    ],
+                )
+        copied_ids.update(order_ids)
+        return len(order_ids)
+
+    def _set_placement(self, user_id, **values):
+        self.directory.execute(
+            user_shards.update().where(user_shards.c.user_id == user_id).values(**values)
+        )
+
+    def move_user(self, user_id, target_shard):
+        """Move a user and all of their orders and line items to another shard.
+
+        The user is flagged as moving in the directory first. Setting the flag
+        waits for any `insert_order` holding the user's directory row, and
+        later ones refuse the order until the move is over. Rows are copied
+        to the target, then the source rows are deleted in a transaction that
+        only commits after the directory points at the target. If any step
+        fails, the directory is pointed back at the source and the copies are
+        removed from the target.
+
+        Raises:
+            ShardMoveError: If the user is already being moved.
+        """
+        source_shard = self.shard_for(user_id)
+        if source_shard == target_shard:
+            return
+        source = self.engines[source_shard]
+        target = self.engines[target_shard]
+
+        fence = self.directory.execute(
+            user_shards.update()
+            .where(user_shards.c.user_id == user_id)
+            .where(user_shards.c.moving.is_(False))
+            .values(moving=True)
+        )
+        if fence.rowcount != 1:
+            raise ShardMoveError(
+                "User ID {id} is already being moved".format(id=user_id)
+            )
+
+        copied_ids = set()
+        try:
+            user = source.execute(
+                users.select().where(users.c.user_id == user_id)
+            ).first()
+            target.execute(users.insert().values(**dict(user)))
+            self._copy_orders(source, target, user_id, copied_ids)
+            with source.begin() as connection:
+                self._delete_orders(connection, copied_ids, user_id)
+                # On a shared SQLite file, only this connection may write.
+                directory = connection if source is self.directory else self.directory
+                directory.execute(
+                    user_shards.update()
+                    .where(user_shards.c.user_id == user_id)
+                    .values(shard_id=target_shard)
+                )
+        except Exception:
+            with target.begin() as connection:
+                self._delete_orders(connection, copied_ids, user_id)
+            self._set_placement(user_id, shard_id=source_shard, moving=False)
+            raise
+
+        self._set_placement(user_id, moving=False)
+
+    def rebalance(self):
+        """Move users until every shard holds the same number of users, give
+        or take one.
+
+        Returns:
+            list: `(user_id, source_shard, target_shard)` for each move made.
+        """
+        s = select([user_shards.c.user_id, user_shards.c.shard_id]).order_by(
+            user_shards.c.user_id
+        )
+        placement = {shard_id: [] for shard_id in range(len(self.engines))}
+        for user_id, shard_id in self.directory.execute(s):
+            placement[shard_id].append(user_id)
+
+        moves = []
+        while True:
+            smallest = min(placement, key=lambda shard_id: len(placement[shard_id]))
+            largest = max(placement, key=lambda shard_id: len(placement[shard_id]))
+            if len(placement[largest]) - len(placement[smallest]) <= 1:
+                break
+            user_id = placement[largest].pop()
+            self.move_user(user_id, smallest)
+            placement[smallest].append(user_id)
+            moves.append((user_id, largest, smallest))
+        return moves
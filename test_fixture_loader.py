@@ -0,0 +1,53 @@
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.exc import IntegrityError
+
+from fixture_loader import key_ranges, load
+from schema import cookies, line_items, orders, users
+
+
+def test_key_ranges_cover_every_key_once():
+    assert key_ranges(10, 3) == [(1, 5), (5, 9), (9, 11)]
+    assert key_ranges(2, 4) == [(1, 2), (2, 3)]
+    assert key_ranges(0, 4) == []
+
+
+def test_load_respects_foreign_keys(tmp_path):
+    url = "sqlite:///{}".format(tmp_path / "fixtures.db")
+
+    counts = load(
+        url,
+        user_count=50,
+        orders_per_user=2,
+        items_per_order=3,
+        cookie_count=10,
+        workers=2,
+        chunk_size=7,
+    )
+
+    assert counts == {"cookies": 10, "users": 50, "orders": 100, "line_items": 300}
+    engine = create_engine(url)
+    for table in (cookies, users, orders, line_items):
+        count = engine.execute(select([func.count()]).select_from(table)).scalar()
+        assert count == counts[table.name]
+    orphans = (
+        select([func.count()])
+        .select_from(line_items.outerjoin(orders).outerjoin(users))
+        .where(users.c.user_id.is_(None))
+    )
+    assert engine.execute(orphans).scalar() == 0
+    s = select([func.count(orders.c.order_id)]).where(orders.c.user_id == 50)
+    assert engine.execute(s).scalar() == 2
+
+
+def test_load_rejects_loading_without_cookies(tmp_path):
+    url = "sqlite:///{}".format(tmp_path / "fixtures.db")
+    with pytest.raises(ValueError):
+        load(url, user_count=1, cookie_count=0)
+
+
+def test_load_needs_empty_tables(tmp_path):
+    url = "sqlite:///{}".format(tmp_path / "fixtures.db")
+    load(url, user_count=1, cookie_count=1, workers=1)
+    with pytest.raises(IntegrityError):
+        load(url, user_count=1, cookie_count=1, workers=1)
@@ -0,0 +1,165 @@
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine, select, update
+
+import inventory_cdc
+from inventory_cdc import InventoryChange, InventoryChangeStream
+from schema import cookies, metadata
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine("sqlite:///{}".format(tmp_path / "cdc.db"))
+    metadata.create_all(engine)
+    inventory_cdc.install(engine)
+    return engine
+
+
+def collect(stream, count):
+    changes = []
+    for batch in stream.batches():
+        changes.extend(batch)
+        if len(changes) >= count:
+            break
+    return changes
+
+
+# pylint: disable=no-value-for-parameter
+def test_restock_and_ship_emit_changes(engine):
+    engine.execute(cookies.insert().values(cookie_name="chocolate chip", quantity=12))
+    with InventoryChangeStream(engine, max_wait=0.1) as stream:
+        engine.execute(
+            update(cookies)
+            .where(cookies.c.cookie_name == "chocolate chip")
+            .values(quantity=(cookies.c.quantity + 120))
+        )
+        engine.execute(
+            update(cookies)
+            .where(cookies.c.cookie_id == 1)
+            .values(quantity=(cookies.c.quantity - 9))
+        )
+        changes = collect(stream, 3)
+
+    assert changes == [
+        InventoryChange(1, None, 12, None),
+        InventoryChange(1, 12, 132, None),
+        InventoryChange(1, 132, 123, None),
+    ]
+
+
+def test_unchanged_quantity_is_not_emitted(engine):
+    engine.execute(cookies.insert().values(cookie_name="chocolate chip", quantity=12))
+    engine.execute(
+        update(cookies).where(cookies.c.cookie_id == 1).values(cookie_sku="CC01")
+    )
+    rows = engine.execute(select([inventory_cdc.inventory_changes])).fetchall()
+    assert len(rows) == 1
+
+
+def test_batches_respect_batch_size_and_acknowledge(engine):
+    engine.execute(
+        cookies.insert(),
+        [{"cookie_name": "cookie {}".format(i), "quantity": i} for i in range(5)],
+    )
+    with InventoryChangeStream(engine, batch_size=2, max_wait=0.1) as stream:
+        batches = stream.batches()
+        assert len(next(batches)) == 2
+        assert len(next(batches)) == 2
+        # The first batch was acknowledged when the second one was requested.
+        rows = engine.execute(select([inventory_cdc.inventory_changes])).fetchall()
+        assert [row.cookie_id for row in rows] == [3, 4, 5]
+        batches.close()
+
+
+def test_full_queue_holds_back_the_reader(engine):
+    engine.execute(
+        cookies.insert(),
+        [{"cookie_name": "cookie {}".format(i), "quantity": i} for i in range(5)],
+    )
+    with InventoryChangeStream(engine, max_pending=2, max_wait=0.1) as stream:
+        # Nobody consumes: the reader fills the queue and then waits.
+        time.sleep(0.3)
+        assert stream.pending == 2
+        rows = engine.execute(select([inventory_cdc.inventory_changes])).fetchall()
+        assert len(rows) == 5
+
+        changes = collect(stream, 5)
+        assert stream.pending <= 2
+    assert [change.cookie_id for change in changes] == [1, 2, 3, 4, 5]
+
+
+# pylint: disable=no-value-for-parameter
+def test_changes_after_draining_the_outbox_are_delivered(engine):
+    engine.execute(
+        cookies.insert(),
+        [{"cookie_name": "cookie {}".format(i), "quantity": i} for i in range(3)],
+    )
+    restock = update(cookies).where(cookies.c.cookie_id == 1).values(quantity=50)
+    with InventoryChangeStream(engine, max_wait=0.1) as stream:
+        batches = stream.batches()
+        assert [change.cookie_id for change in next(batches)] == [1, 2, 3]
+        # Asking for the next batch deletes the first one, leaving the outbox
+        # empty before the restock is written.
+        timer = threading.Timer(0.3, engine.execute, [restock])
+        timer.start()
+        # Ends the stream, and the wait below, if the restock never arrives.
+        watchdog = threading.Timer(3, stream.stop)
+        watchdog.start()
+        assert next(batches, []) == [InventoryChange(1, 0, 50, None)]
+        watchdog.cancel()
+        timer.join()
+        batches.close()
+
+
+def test_every_subscriber_receives_every_change(engine):
+    engine.execute(
+        cookies.insert(),
+        [{"cookie_name": "cookie {}".format(i), "quantity": i} for i in range(3)],
+    )
+    with InventoryChangeStream(engine, "shipping", max_wait=0.1) as shipping:
+        with InventoryChangeStream(engine, "billing", max_wait=0.1) as billing:
+            assert len(collect(shipping, 3)) == 3
+            shipping.acknowledge()
+            # Billing has not read them yet, so the outbox keeps them.
+            rows = engine.execute(select([inventory_cdc.inventory_changes]))
+            assert len(rows.fetchall()) == 3
+            assert len(collect(billing, 3)) == 3
+            billing.acknowledge()
+    rows = engine.execute(select([inventory_cdc.inventory_changes])).fetchall()
+    assert rows == []
+
+
+def test_unacknowledged_changes_are_delivered_again(engine):
+    engine.execute(
+        cookies.insert(),
+        [{"cookie_name": "cookie {}".format(i), "quantity": i} for i in range(3)],
+    )
+    with InventoryChangeStream(engine, max_wait=0.1) as stream:
+        assert len(collect(stream, 3)) == 3
+    with InventoryChangeStream(engine, max_wait=0.1) as stream:
+        assert len(collect(stream, 3)) == 3
+        stream.acknowledge()
+    engine.execute(cookies.insert().values(cookie_name="oatmeal", quantity=1))
+    with InventoryChangeStream(engine, max_wait=0.1) as stream:
+        assert [change.cookie_id for change in collect(stream, 1)] == [4]
+        stream.acknowledge()
+    rows = engine.execute(select([inventory_cdc.inventory_changes])).fetchall()
+    assert rows == []
+
+
+def test_unsubscribe_releases_the_outbox(engine):
+    stale = InventoryChangeStream(engine, "stale")
+    stale.start()
+    stale.stop()
+    engine.execute(cookies.insert().values(cookie_name="oatmeal", quantity=1))
+    with InventoryChangeStream(engine, max_wait=0.1) as stream:
+        assert len(collect(stream, 1)) == 1
+        stream.acknowledge()
+    rows = engine.execute(select([inventory_cdc.inventory_changes])).fetchall()
+    assert len(rows) == 1
+
+    inventory_cdc.unsubscribe(engine, "stale")
+    rows = engine.execute(select([inventory_cdc.inventory_changes])).fetchall()
+    assert rows == []
@@ -0,0 +1,119 @@
+import pytest
+from sqlalchemy import create_engine
+
+import plan_guard
+import search
+from queries import new_cookies, QUERY_SETS
+from schema import metadata
+
+
+@pytest.fixture
+def connection(tmp_path):
+    engine = create_engine("sqlite:///{}".format(tmp_path / "plans.db"))
+    metadata.create_all(engine)
+    with engine.connect() as connection:
+        yield connection
+
+
+def test_capture_covers_every_canonical_query(connection):
+    plans = plan_guard.capture(connection)
+    assert set(plans) == set(plan_guard.CANONICAL_QUERIES)
+    assert plan_guard.compare(plans, plan_guard.capture(connection)) == []
+
+
+def test_dropped_index_is_flagged(connection, tmp_path):
+    baseline_path = str(tmp_path / "baseline.json")
+    plan_guard.save_baseline(baseline_path, plan_guard.capture(connection))
+
+    connection.execute("DROP INDEX ix_cookies_cookie_name")
+
+    with pytest.raises(plan_guard.PlanRegressionError) as e:
+        plan_guard.check(connection, baseline_path)
+    regressions = dict(e.value.regressions)
+    assert regressions["cookie_by_name"] == (
+        "plan changed: removed [Index Scan on cookies using ix_cookies_cookie_name]"
+        ", added [Seq Scan on cookies]"
+    )
+
+
+def test_sqlite_node_maps_plan_steps():
+    assert plan_guard.sqlite_node("SCAN cookies") == {
+        "Node Type": "Seq Scan",
+        "Relation Name": "cookies",
+    }
+    assert plan_guard.sqlite_node(
+        "SEARCH users USING INTEGER PRIMARY KEY (rowid=?)"
+    ) == {
+        "Node Type": "Index Scan",
+        "Relation Name": "users",
+        "Index Name": "PRIMARY KEY",
+    }
+    assert plan_guard.sqlite_node("USE TEMP B-TREE FOR ORDER BY") == {
+        "Node Type": "Sort"
+    }
+
+
+def test_cost_increase_beyond_threshold():
+    shape = {"node": "Seq Scan", "relation": "cookies"}
+    plan = {"fingerprint": plan_guard.fingerprint(shape), "shape": shape}
+    baseline = {"all_cookies": dict(plan, total_cost=100.0)}
+
+    assert (
+        plan_guard.compare(baseline, {"all_cookies": dict(plan, total_cost=110.0)})
+        == []
+    )
+    assert plan_guard.compare(
+        baseline, {"all_cookies": dict(plan, total_cost=150.0)}
+    ) == [plan_guard.Regression("all_cookies", "cost went from 100.00 to 150.00")]
+
+
+def test_queries_missing_from_baseline_are_reported(connection):
+    plans = plan_guard.capture(connection)
+    baseline = dict(plans)
+    del baseline["all_cookies"]
+
+    assert plan_guard.compare(baseline, plans) == [
+        plan_guard.Regression(
+            "all_cookies", "query is not in the baseline, re-capture it"
+        )
+    ]
+
+
+def test_dropped_username_index_is_flagged(connection, tmp_path):
+    baseline_path = str(tmp_path / "baseline.json")
+    plan_guard.save_baseline(baseline_path, plan_guard.capture(connection))
+
+    connection.execute("ALTER TABLE users RENAME TO old_users")
+    connection.execute("CREATE TABLE users AS SELECT * FROM old_users WHERE 0")
+
+    with pytest.raises(plan_guard.PlanRegressionError) as e:
+        plan_guard.check(connection, baseline_path)
+    assert "user_by_username" in dict(e.value.regressions)
+
+
+def test_missing_tables_are_reported(connection):
+    with pytest.raises(plan_guard.MissingTablesError) as e:
+        plan_guard.capture(connection, QUERY_SETS["ch12"](connection.dialect))
+    assert e.value.tables == ["new_cookies", "new_cookies_fts"]
+
+
+def test_capture_new_cookies_queries(connection):
+    new_cookies.create(connection)
+    search.install(connection, new_cookies)
+    queries = QUERY_SETS["ch12"](connection.dialect)
+
+    plans = plan_guard.capture(connection, queries)
+
+    assert set(plans) == set(queries)
+    assert plan_guard.normalize(
+        plan_guard.explain(connection, queries["cookie_by_name"])
+    ) == {
+        "node": "Query",
+        "children": [
+            {
+                "node": "Index Scan",
+                "relation": "new_cookies",
+                "index": "ix_new_cookies_cookie_name",
+            }
+        ],
+    }
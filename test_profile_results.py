@@ -0,0 +1,110 @@
+import io
+import os
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.dialects.postgresql import psycopg2
+from sqlalchemy.engine import result
+
+import profile_results
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine("sqlite:///{}".format(tmp_path / "profile.db"))
+    profile_results.seed(engine, 2000, chunk_size=500)
+    return engine
+
+
+def test_classify_frames():
+    fetchall_line = profile_results.DRIVER_LINES[result.__file__][2][0] + 1
+    assert (
+        profile_results.classify(result.__file__, fetchall_line)
+        == profile_results.DRIVER_FETCH
+    )
+    assert profile_results.classify(result.__file__, 1) == (
+        profile_results.ROW_CONSTRUCTION
+    )
+    processors = os.path.join(profile_results.SQLALCHEMY_DIR, "processors.py")
+    assert profile_results.classify(processors, 1) == profile_results.TYPE_PROCESSING
+    assert profile_results.classify(__file__, 1) == profile_results.USER_CODE
+    timer_line = profile_results.TYPE_LINES[profile_results.__file__][0][0] + 1
+    assert (
+        profile_results.classify(profile_results.__file__, timer_line)
+        == profile_results.TYPE_PROCESSING
+    )
+
+
+def test_classify_dialect_frames_by_function():
+    numeric_line = profile_results._line_range(psycopg2._PGNumeric.result_processor)[1]
+    assert (
+        profile_results.classify(psycopg2.__file__, numeric_line)
+        == profile_results.TYPE_PROCESSING
+    )
+    executemany_line = profile_results._line_range(
+        psycopg2.PGDialect_psycopg2.do_executemany
+    )[1]
+    assert (
+        profile_results.classify(psycopg2.__file__, executemany_line)
+        == profile_results.DRIVER_FETCH
+    )
+    context_line = profile_results._line_range(
+        psycopg2.PGExecutionContext_psycopg2.post_exec
+    )[1]
+    assert (
+        profile_results.classify(psycopg2.__file__, context_line)
+        == profile_results.SQLALCHEMY
+    )
+
+
+def test_classify_stack_prefers_database_frames():
+    user_frame = (__file__, 1, "test")
+    row_frame = (result.__file__, 1, "process_rows")
+    assert (
+        profile_results.classify_stack((user_frame, row_frame))
+        == profile_results.ROW_CONSTRUCTION
+    )
+    assert profile_results.classify_stack((user_frame,)) == profile_results.USER_CODE
+
+
+@pytest.mark.parametrize("path", sorted(profile_results.QUERY_PATHS))
+def test_profile_query_path(engine, path):
+    run = profile_results.profile(
+        profile_results.QUERY_PATHS[path], engine, interval=0.0005
+    )
+
+    summary = run.summary()
+    assert [row[0] for row in summary] == profile_results.CATEGORIES
+    assert sum(row[3] for row in summary) > 0
+    assert "row construction" in run.format_summary()
+
+    folded = io.StringIO()
+    run.write_folded(folded, kind="memory")
+    for line in folded.getvalue().splitlines():
+        stack, weight = line.rsplit(" ", 1)
+        assert stack.split(";")[0] in profile_results.CATEGORIES
+        assert int(weight) > 0
+
+
+def test_profile_attributes_decimal_conversion(engine):
+    run = profile_results.profile(profile_results.unit_costs, engine, interval=0.0005)
+
+    assert run.processors.calls >= 2000
+    assert run.processors.seconds > 0
+    summary = {row[0]: row for row in run.summary()}
+    assert summary[profile_results.TYPE_PROCESSING][3] > 0
+
+
+def test_profile_time_adds_up_to_elapsed(engine):
+    def busy(engine):
+        deadline = time.perf_counter() + 0.2
+        while time.perf_counter() < deadline:
+            profile_results.iterate_rows(engine)
+
+    start = time.perf_counter()
+    run = profile_results.profile(busy, engine, interval=0.001)
+    elapsed = time.perf_counter() - start
+
+    sampled = sum(row[1] for row in run.summary())
+    assert 0.5 * elapsed < sampled <= elapsed
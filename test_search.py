@@ -0,0 +1,68 @@
+import pytest
+from sqlalchemy import create_engine, update
+from sqlalchemy.dialects import postgresql
+
+import search
+from schema import cookies, metadata
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine("sqlite:///{}".format(tmp_path / "search.db"))
+    metadata.create_all(engine)
+    engine.execute(
+        cookies.insert(),
+        [
+            {"cookie_name": "chocolate chip"},
+            {"cookie_name": "dark chocolate chip"},
+            {"cookie_name": "peanut butter"},
+        ],
+    )
+    search.install(engine)
+    engine.execute(cookies.insert(), [{"cookie_name": "oatmeal raisin"}])
+    return engine
+
+
+def test_fts5_query_quotes_words_as_prefixes():
+    assert search.fts5_query('choc "chip') == '"choc"* "chip"*'
+
+
+def test_search_matches_existing_and_new_rows(engine):
+    names = [row.cookie_name for row in search.search_cookies(engine, "chip")]
+    assert sorted(names) == ["chocolate chip", "dark chocolate chip"]
+    assert [row.cookie_id for row in search.search_cookies(engine, "oat")] == [4]
+    assert search.search_cookies(engine, "  ") == []
+
+
+def test_search_ranks_and_paginates(engine):
+    results = search.search_cookies(engine, "chocolate", per_page=1)
+    assert [row.cookie_name for row in results] == ["chocolate chip"]
+    results = search.search_cookies(engine, "chocolate", page=2, per_page=1)
+    assert [row.cookie_name for row in results] == ["dark chocolate chip"]
+
+
+# pylint: disable=no-value-for-parameter
+def test_search_follows_renamed_cookies(engine):
+    engine.execute(
+        update(cookies)
+        .where(cookies.c.cookie_name == "peanut butter")
+        .values(cookie_name="almond butter")
+    )
+    assert search.search_cookies(engine, "peanut") == []
+    assert [row.cookie_id for row in search.search_cookies(engine, "almond")] == [3]
+
+
+def test_postgres_query_matches_words_with_trigrams():
+    dialect = postgresql.dialect()
+    compiled = search.search_query(dialect, "penut", page=2, per_page=10).compile(
+        dialect=dialect
+    )
+    sql = str(compiled)
+
+    assert "search_vector @@ websearch_to_tsquery(" in sql
+    assert "%(param_1)s <%% cookies.cookie_name" in sql
+    assert "word_similarity(%(word_similarity_1)s, cookies.cookie_name)" in sql
+    assert "ORDER BY rank DESC, cookies.cookie_id" in sql
+    assert compiled.params["param_1"] == "penut"
+    assert compiled.params["param_2"] == 10
+    assert compiled.params["param_3"] == 10
@@ -0,0 +1,250 @@
+import threading
+
+import pytest
+from sqlalchemy import create_engine, event, select, update
+
+from schema import cookies, orders, users
+from sharding import (
+    order_shards,
+    ReplicationError,
+    ShardedDatabase,
+    ShardMoveError,
+    user_shards,
+)
+
+customer_list = [
+    {
+        "username": "cookiemon",
+        "email_address": "mon@cookie.com",
+        "phone": "111-111-1111",
+        "password": "password",
+    },
+    {
+        "username": "cakeeater",
+        "email_address": "cakeeater@cake.com",
+        "phone": "222-222-2222",
+        "password": "password",
+    },
+    {
+        "username": "pieguy",
+        "email_address": "guy@pie.com",
+        "phone": "333-333-3333",
+        "password": "password",
+    },
+]
+
+inventory_list = [
+    {
+        "cookie_name": "chocolate chip",
+        "cookie_recipe_url": "http://some.aweso.me/cookie/recipe.html",
+        "cookie_sku": "CC01",
+        "quantity": 12,
+        "unit_cost": "0.50",
+    },
+    {
+        "cookie_name": "peanut butter",
+        "cookie_recipe_url": "http://some.aweso.me/cookie/peanut.html",
+        "cookie_sku": "PB01",
+        "quantity": 24,
+        "unit_cost": "0.25",
+    },
+]
+
+
+@pytest.fixture
+def shards(tmp_path):
+    engines = [
+        create_engine("sqlite:///{}".format(tmp_path / "shard{}.db".format(i)))
+        for i in range(3)
+    ]
+    db = ShardedDatabase(engines)
+    db.create_all()
+    db.insert_cookies(inventory_list)
+    return db
+
+
+def count_rows(engine, table):
+    return len(engine.execute(select([table])).fetchall())
+
+
+def test_users_and_orders_are_routed_to_one_shard(shards):
+    user_ids = [shards.insert_user(**customer) for customer in customer_list]
+    for user_id in user_ids:
+        shards.insert_order(
+            user_id, [{"cookie_id": 1, "quantity": 2, "extended_cost": 1.00}]
+        )
+
+    for engine in shards.engines:
+        assert count_rows(engine, users) == 1
+        assert count_rows(engine, orders) == 1
+
+    result = shards.get_orders_by_customers("cakeeater", details=True)
+    assert [(row.username, row.cookie_name) for row in result] == [
+        ("cakeeater", "chocolate chip")
+    ]
+    assert shards.get_orders_by_customers("nobody") == []
+
+
+def test_cookies_are_replicated_to_every_shard(shards):
+    u = (
+        update(cookies)
+        .where(cookies.c.cookie_name == "chocolate chip")
+        .values(quantity=(cookies.c.quantity + 120))
+    )
+    shards.execute_on_all(u)
+
+    s = select([cookies.c.cookie_id, cookies.c.quantity]).order_by(cookies.c.cookie_id)
+    for engine in shards.engines:
+        assert engine.execute(s).fetchall() == [(1, 132), (2, 24)]
+
+
+def test_failed_replicated_write_rolls_back_every_shard(shards):
+    shards.engines[2].execute("DROP TABLE cookies")
+    u = update(cookies).values(quantity=0)
+
+    with pytest.raises(Exception):
+        shards.execute_on_all(u)
+
+    s = select([cookies.c.quantity]).order_by(cookies.c.cookie_id)
+    for engine in shards.engines[:2]:
+        assert engine.execute(s).fetchall() == [(12,), (24,)]
+
+
+def test_failed_commit_is_reported_and_detected(shards):
+    @event.listens_for(shards.engines[1], "commit")
+    def fail_commit(conn):
+        raise RuntimeError("disk full")
+
+    with pytest.raises(ReplicationError) as excinfo:
+        shards.execute_on_all(update(cookies).values(quantity=0))
+
+    assert list(excinfo.value.failures) == [1]
+    event.remove(shards.engines[1], "commit", fail_commit)
+    assert shards.diverged_replicas() == [1]
+
+
+def test_order_counts_scatter_gather(shards):
+    cookiemon, cakeeater, _ = [
+        shards.insert_user(**customer) for customer in customer_list
+    ]
+    shards.insert_order(cookiemon, [])
+    shards.insert_order(cookiemon, [])
+    shards.insert_order(cakeeater, [])
+
+    assert shards.order_counts() == {"cookiemon": 2, "cakeeater": 1, "pieguy": 0}
+
+
+def test_move_user_takes_orders_and_line_items(shards):
+    user_id = shards.insert_user(**customer_list[0])
+    order_id = shards.insert_order(
+        user_id,
+        [
+            {"cookie_id": 1, "quantity": 2, "extended_cost": 1.00},
+            {"cookie_id": 2, "quantity": 12, "extended_cost": 3.00},
+        ],
+    )
+    source = shards.shard_for(user_id)
+    target = (source + 1) % len(shards.engines)
+
+    shards.move_user(user_id, target)
+
+    assert shards.shard_for(user_id) == target
+    assert count_rows(shards.engines[source], users) == 0
+    assert count_rows(shards.engines[source], orders) == 0
+    result = shards.get_orders_by_customers("cookiemon", details=True)
+    assert [row.order_id for row in result] == [order_id, order_id]
+
+
+def test_rebalance_evens_out_shards(shards):
+    user_ids = [shards.insert_user(**customer) for customer in customer_list]
+    for user_id in user_ids:
+        shards.move_user(user_id, 0)
+
+    moves = shards.rebalance()
+
+    assert len(moves) == 2
+    for engine in shards.engines:
+        assert count_rows(engine, users) == 1
+
+
+# pylint: disable=no-value-for-parameter
+def test_orders_are_refused_while_user_is_moving(shards):
+    user_id = shards.insert_user(**customer_list[0])
+    shards.directory.execute(
+        user_shards.update().where(user_shards.c.user_id == user_id).values(moving=True)
+    )
+
+    with pytest.raises(ShardMoveError):
+        shards.insert_order(user_id, [])
+    with pytest.raises(ShardMoveError):
+        shards.move_user(user_id, (shards.shard_for(user_id) + 1) % 3)
+    assert count_rows(shards.directory, order_shards) == 0
+    assert count_rows(shards.engine_for(user_id), orders) == 0
+
+
+def test_failed_shard_write_removes_directory_row(shards):
+    user_id = shards.insert_user(**customer_list[0])
+    shards.engine_for(user_id).execute("DROP TABLE line_items")
+
+    with pytest.raises(Exception):
+        shards.insert_order(
+            user_id, [{"cookie_id": 1, "quantity": 2, "extended_cost": 1.00}]
+        )
+    assert count_rows(shards.directory, order_shards) == 0
+    assert count_rows(shards.engine_for(user_id), orders) == 0
+
+    shards.engines[2].execute("DROP TABLE users")
+    with pytest.raises(Exception):
+        shards.insert_user(**customer_list[1])
+    assert count_rows(shards.directory, user_shards) == 1
+
+
+def test_move_waits_for_order_in_flight(shards):
+    user_id = shards.insert_user(**customer_list[0])
+    source = shards.shard_for(user_id)
+    target = (source + 1) % len(shards.engines)
+    order_written = threading.Event()
+    release = threading.Event()
+
+    @event.listens_for(shards.engines[source], "after_execute")
+    def pause_after_order(conn, clauseelement, *args):
+        if getattr(clauseelement, "table", None) is orders:
+            order_written.set()
+            release.wait(5)
+
+    order = threading.Thread(target=shards.insert_order, args=(user_id, []))
+    order.start()
+    assert order_written.wait(5)
+    move = threading.Thread(target=shards.move_user, args=(user_id, target))
+    move.start()
+    move.join(0.3)
+    assert move.is_alive()
+    release.set()
+    order.join()
+    move.join()
+
+    assert shards.shard_for(user_id) == target
+    assert count_rows(shards.engines[source], users) == 0
+    assert count_rows(shards.engines[source], orders) == 0
+    assert count_rows(shards.engines[target], orders) == 1
+
+
+def test_failed_cleanup_leaves_user_on_source(shards):
+    user_id = shards.insert_user(**customer_list[0])
+    shards.insert_order(user_id, [])
+    source = shards.shard_for(user_id)
+    target = (source + 1) % len(shards.engines)
+
+    @event.listens_for(shards.engines[source], "before_execute")
+    def fail_delete(conn, clauseelement, *args):
+        if str(clauseelement).startswith("DELETE FROM users"):
+            raise RuntimeError("connection lost")
+
+    with pytest.raises(RuntimeError):
+        shards.move_user(user_id, target)
+
+    assert shards.shard_for(user_id) == source
+    assert count_rows(shards.engines[source], orders) == 1
+    assert count_rows(shards.engines[target], users) == 0
+    assert count_rows(shards.engines[target], orders) == 0
+    shards.insert_order(user_id, [])